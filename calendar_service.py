@@ -1,5 +1,8 @@
 import os.path
 import datetime
+import threading
+import functools
+from collections import OrderedDict
 import pytz
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
@@ -8,14 +11,40 @@ from googleapiclient.discovery import build
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# Number of most recently viewed dates whose slot status is kept for diffing
+MAX_SLOT_SNAPSHOTS = 31
+
+def _serialized(method):
+    """
+    Runs the method under the instance's API lock.
+    The Google API client (httplib2) is not thread-safe, and one calendar is
+    used by request threads and the clinic-wide availability pool at once.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._api_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 class CalendarService:
-    def __init__(self, credentials_path="credentials.json", token_path="token.json"):
+    def __init__(self, credentials_path="credentials.json", token_path="token.json", broadcaster=None,
+                 calendar_id="primary", token_env="GOOGLE_TOKEN_JSON", doctor_id=None):
         self.creds = None
         self.base_dir = os.path.dirname(os.path.abspath(__file__))
         self.credentials_path = os.path.join(self.base_dir, credentials_path)
         self.token_path = os.path.join(self.base_dir, token_path)
+        self.calendar_id = calendar_id
+        self.token_env = token_env
+        self.doctor_id = doctor_id
         self.service = None
+        # Calendar timezone rarely changes; fetched once per calendar
+        self._tz = None
+        # Optional SlotEventBroadcaster; receives slot deltas on every change
+        self.broadcaster = broadcaster
+        # Last known status map per date, used to diff calendar syncs (LRU, bounded)
+        self._slot_snapshots = OrderedDict()
+        self._snapshot_lock = threading.Lock()
+        self._api_lock = threading.RLock()
         self.authenticate()
 
     def authenticate(self):
@@ -23,7 +52,7 @@ class CalendarService:
         import json
         
         # 1. Try Loading Token from Environment (for Vercel)
-        token_json_env = os.getenv("GOOGLE_TOKEN_JSON")
+        token_json_env = os.getenv(self.token_env)
         if token_json_env:
             try:
                 info = json.loads(token_json_env)
@@ -79,21 +108,30 @@ class CalendarService:
             print(f"Error building calendar service: {e}")
             self.service = None
 
+    def _get_timezone(self):
+        """Returns the calendar's timezone, cached after the first lookup"""
+        if self._tz is None:
+            calendar_info = self.service.calendars().get(calendarId=self.calendar_id).execute()
+            self._tz = pytz.timezone(calendar_info.get('timeZone', 'UTC'))
+        return self._tz
+
     def _get_events_for_day(self, date_str):
-        """Helper to get all events for a specific day"""
-        if not self.service: return []
+        """
+        Helper to get all events for a specific day.
+        Returns None if the calendar could not be read, so callers can tell
+        a failed fetch apart from a day with no events.
+        """
+        if not self.service: return None
         try:
             # Get Calendar Timezone
-            calendar_info = self.service.calendars().get(calendarId='primary').execute()
-            tz_name = calendar_info.get('timeZone', 'UTC')
-            tz = pytz.timezone(tz_name)
+            tz = self._get_timezone()
             
             target_date = datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
             day_start = tz.localize(datetime.datetime.combine(target_date, datetime.time(0, 0)))
             day_end = tz.localize(datetime.datetime.combine(target_date, datetime.time(23, 59, 59)))
             
             events_result = self.service.events().list(
-                calendarId='primary',
+                calendarId=self.calendar_id,
                 timeMin=day_start.isoformat(),
                 timeMax=day_end.isoformat(),
                 singleEvents=True,
@@ -102,7 +140,7 @@ class CalendarService:
             return events_result.get('items', [])
         except Exception as e:
             print(f"Error fetching events: {e}")
-            return []
+            return None
 
     def _generate_shift_slots(self):
         """Generates 30-min slots for Morning (10-1) and Evening (5-9)"""
@@ -123,21 +161,26 @@ class CalendarService:
             
         return slots
 
+    @_serialized
     def get_slot_status(self, date_str):
         """
         Returns status of the slots for the doctor dashboard.
         Status: 'available', 'booked', 'blocked'
         Returns a dict: { time: { 'status': '...', 'details': '...' } }
+        Raises RuntimeError if the calendar cannot be read, rather than
+        reporting booked or blocked slots as available.
         """
+        if not self.service:
+            raise RuntimeError("Calendar not connected")
         events = self._get_events_for_day(date_str)
+        if events is None:
+            raise RuntimeError("Could not read calendar")
         generated_slots = self._generate_shift_slots()
         status_map = {}
         
         # Get Calendar Timezone
         try:
-             calendar_info = self.service.calendars().get(calendarId='primary').execute()
-             tz_name = calendar_info.get('timeZone', 'UTC')
-             tz = pytz.timezone(tz_name)
+             tz = self._get_timezone()
         except:
              tz = pytz.UTC
 
@@ -179,14 +222,42 @@ class CalendarService:
                     continue
             
             status_map[time_str] = slot_data
-            
+
+        self._sync_snapshot(date_str, status_map)
         return status_map
 
+    def _sync_snapshot(self, date_str, status_map):
+        """
+        Diffs a freshly synced status map against the last known one and
+        publishes only the slots that changed (e.g. events added directly in Google Calendar).
+        """
+        with self._snapshot_lock:
+            previous = self._slot_snapshots.pop(date_str, None)
+            self._slot_snapshots[date_str] = dict(status_map)
+            while len(self._slot_snapshots) > MAX_SLOT_SNAPSHOTS:
+                self._slot_snapshots.popitem(last=False)
+        if previous is None:
+            return
+        changed = {t: data for t, data in status_map.items() if previous.get(t) != data}
+        if changed and self.broadcaster:
+            self.broadcaster.publish(date_str, changed, doctor_id=self.doctor_id)
+
+    def _publish(self, date_str, slots):
+        """Records the change locally and pushes it to connected dashboards"""
+        with self._snapshot_lock:
+            snapshot = self._slot_snapshots.get(date_str)
+            if snapshot is not None:
+                snapshot.update(slots)
+        if self.broadcaster:
+            self.broadcaster.publish(date_str, slots, doctor_id=self.doctor_id)
+
+    @_serialized
     def get_available_slots(self, date_str):
         """Returns ONLY the available slots for the patient"""
         status_map = self.get_slot_status(date_str)
         return [slot for slot, data in status_map.items() if data['status'] == 'available']
 
+    @_serialized
     def toggle_slot(self, date_str, time_str, action):
         """
         Action: 'block' (mark unavailable), 'unblock' (mark available)
@@ -195,9 +266,7 @@ class CalendarService:
         
         try:
             # Get Calendar Timezone
-            calendar_info = self.service.calendars().get(calendarId='primary').execute()
-            tz_name = calendar_info.get('timeZone', 'UTC')
-            tz = pytz.timezone(tz_name)
+            tz = self._get_timezone()
 
             if action == 'block':
                 # Create a "BLOCKED" event
@@ -211,12 +280,15 @@ class CalendarService:
                     'start': {'dateTime': start_dt.isoformat()},
                     'end': {'dateTime': end_dt.isoformat()}
                 }
-                self.service.events().insert(calendarId='primary', body=event).execute()
+                self.service.events().insert(calendarId=self.calendar_id, body=event).execute()
+                self._publish(date_str, {time_str: {'status': 'blocked', 'details': ''}})
                 return True, "Slot blocked"
                 
             elif action == 'unblock':
                 # Find the BLOCKED event and delete it
                 events = self._get_events_for_day(date_str)
+                if events is None:
+                    return False, "Could not read calendar"
                 for event in events:
                     if event.get('summary') == 'BLOCKED':
                         start = event['start'].get('dateTime')
@@ -224,7 +296,8 @@ class CalendarService:
                              try:
                                  e_start = datetime.datetime.fromisoformat(start)
                                  if e_start.strftime("%H:%M") == time_str:
-                                    self.service.events().delete(calendarId='primary', eventId=event['id']).execute()
+                                    self.service.events().delete(calendarId=self.calendar_id, eventId=event['id']).execute()
+                                    self._publish(date_str, {time_str: {'status': 'available', 'details': ''}})
                                     return True, "Slot unblocked"
                              except:
                                  continue
@@ -233,6 +306,7 @@ class CalendarService:
         except Exception as e:
             return False, str(e)
 
+    @_serialized
     def book_slot(self, start_time_iso, duration_minutes=30, summary="Medical Appointment", description=""):
         if not self.service: return False, "Service not init"
         try:
@@ -240,9 +314,7 @@ class CalendarService:
             # If it comes as '2024-11-20T10:00' (naive), we add 'Z' or local offset.
             
             # Fetch timezone
-            calendar_info = self.service.calendars().get(calendarId='primary').execute()
-            tz_name = calendar_info.get('timeZone', 'UTC')
-            tz = pytz.timezone(tz_name)
+            tz = self._get_timezone()
 
             # Check if iso string already has key
             valid_iso = start_time_iso
@@ -262,7 +334,13 @@ class CalendarService:
                 'start': {'dateTime': start.isoformat()},
                 'end': {'dateTime': end.isoformat()},
             }
-            event = self.service.events().insert(calendarId='primary', body=event).execute()
+            event = self.service.events().insert(calendarId=self.calendar_id, body=event).execute()
+
+            # Push the booked slot to open dashboards (in calendar local time)
+            local_start = start.astimezone(tz)
+            details = summary.replace("Appointment: ", "") if summary.startswith("Appointment: ") else summary
+            self._publish(local_start.strftime("%Y-%m-%d"),
+                          {local_start.strftime("%H:%M"): {'status': 'booked', 'details': details}})
             return True, event.get('htmlLink')
         except Exception as e:
             return False, str(e)
@@ -1,4 +1,5 @@
 import os
+import re
 import pymongo
 from pymongo import MongoClient
 from bson.objectid import ObjectId
@@ -8,6 +9,20 @@ import datetime
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = "doctor_dashboard_db"
 
+# Patient timeline: one document per visit / lab / dialysis session
+EVENT_TYPES = ("visit", "lab", "dialysis")
+# Lab values are stored as bare floats under these keys; units are fixed here
+LAB_UNITS = {
+    "creatinine": "mg/dL",
+    "egfr": "mL/min/1.73m2",
+    "urea": "mg/dL",
+    "potassium": "mmol/L",
+    "hemoglobin": "g/dL",
+}
+HISTORY_PAGE_SIZE = 20
+CKD_STAGES = (1, 2, 3, 4, 5)
+HISTORY_MAX_PAGE_SIZE = 100
+
 def get_db_connection():
     """
     Returns a MongoDB database object.
@@ -62,6 +77,7 @@ def init_db():
         seed_data = [
             {
                 "name": "Arjun Kumar", 
+                "ckd_stage": 2,
                 "age": 45, 
                 "gender": "Male", 
                 "contact": "9876543210", 
@@ -70,6 +86,7 @@ def init_db():
             },
             {
                 "name": "Priya Sharma", 
+                "ckd_stage": 3,
                 "age": 62, 
                 "gender": "Female", 
                 "contact": "8765432109", 
@@ -78,6 +95,7 @@ def init_db():
             },
             {
                 "name": "Rahul Verma", 
+                "ckd_stage": None,
                 "age": 38, 
                 "gender": "Male", 
                 "contact": "7654321098", 
@@ -88,6 +106,45 @@ def init_db():
         patients_col.insert_many(seed_data)
         print("Initialized MongoDB with seed data.")
 
+    # Backfill ckd_stage for patients created before the field existed
+    backfilled = 0
+    for patient in patients_col.find({"ckd_stage": {"$exists": False}}, {"history": 1}):
+        patients_col.update_one({"_id": patient['_id']}, {"$set": {"ckd_stage": _parse_ckd_stage(patient.get('history'))}})
+        backfilled += 1
+    if backfilled:
+        print(f"Backfilled ckd_stage for {backfilled} patients.")
+
+    # Timeline reads are always "this patient, newest first"
+    events_col = db['patient_events']
+    events_col.create_index([("patient_id", pymongo.ASCENDING), ("date", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)])
+
+    if events_col.count_documents({}) == 0:
+        seed_events = {
+            "Arjun Kumar": [
+                ("2024-03-12", "visit", "Diagnosed with Stage 2 CKD. Started ACE inhibitor.", {"creatinine": 1.3, "egfr": 72}),
+                ("2024-10-15", "lab", "Routine follow-up labs.", {"creatinine": 1.4, "egfr": 68}),
+            ],
+            "Priya Sharma": [
+                ("2024-06-20", "lab", "Creatinine trending up.", {"creatinine": 2.1, "egfr": 41}),
+                ("2024-09-05", "dialysis", "Started regular dialysis.", None),
+                ("2024-11-01", "lab", "Post-dialysis labs.", {"creatinine": 2.4, "egfr": 36, "potassium": 5.2}),
+            ],
+            "Rahul Verma": [
+                ("2024-11-10", "visit", "Early signs of kidney stones. Recommended increased fluid intake.", {"creatinine": 0.9, "egfr": 98}),
+            ],
+        }
+        for patient in patients_col.find({"name": {"$in": list(seed_events.keys())}}):
+            for date, event_type, notes, labs in seed_events[patient['name']]:
+                events_col.insert_one(_build_event(patient['_id'], event_type, date, notes, labs))
+        print("Initialized patient timeline with seed events.")
+
+    # Monthly lab rollups: one document per (patient, metric, month)
+    rollups_col = db['lab_rollups']
+    rollups_col.create_index([("_id.metric", pymongo.ASCENDING), ("_id.patient_id", pymongo.ASCENDING), ("_id.month", pymongo.ASCENDING)])
+    if rollups_col.count_documents({}) == 0 and events_col.count_documents({"labs": {"$exists": True}}) > 0:
+        rebuild_lab_rollups()
+        print("Built lab rollups from patient timeline.")
+
 def get_all_patients():
     """
     Retrieves all patients. 
@@ -117,11 +174,12 @@ def get_patient(patient_id):
         print(f"Error fetching patient {patient_id}: {e}")
     return None
 
-def add_patient(name, age=None, gender=None, contact=None, history=None, last_visit=None):
+def add_patient(name, age=None, gender=None, contact=None, history=None, last_visit=None, ckd_stage=None):
     """
     Adds a new patient.
     Returns the new patient's ID as a string.
     """
+    ckd_stage = _validate_ckd_stage(ckd_stage)
     db = get_db_connection()
     new_patient = {
         "name": name,
@@ -129,7 +187,301 @@ def add_patient(name, age=None, gender=None, contact=None, history=None, last_vi
         "gender": gender,
         "contact": contact,
         "history": history,
+        "ckd_stage": ckd_stage,
         "last_visit": last_visit if last_visit else datetime.datetime.now().strftime("%Y-%m-%d")
     }
     result = db['patients'].insert_one(new_patient)
     return str(result.inserted_id)
+
+def _parse_ckd_stage(history):
+    """Best-effort CKD stage from free-text history, e.g. 'Stage 3 CKD' or 'CKD stage 3'"""
+    if not history or 'ckd' not in history.lower():
+        return None
+    match = re.search(r"\bstage\s+([1-5])\b", history, re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+def _validate_ckd_stage(ckd_stage):
+    if ckd_stage is None:
+        return None
+    try:
+        ckd_stage = int(ckd_stage)
+    except (TypeError, ValueError):
+        raise ValueError(f"CKD stage must be one of {CKD_STAGES}")
+    if ckd_stage not in CKD_STAGES:
+        raise ValueError(f"CKD stage must be one of {CKD_STAGES}")
+    return ckd_stage
+
+def set_patient_ckd_stage(patient_id, ckd_stage):
+    """
+    Sets or clears (None) a patient's CKD stage.
+    Cohort trends read the stage at query time, so no rollups need rebuilding.
+    Returns True if the patient exists.
+    """
+    ckd_stage = _validate_ckd_stage(ckd_stage)
+    db = get_db_connection()
+    result = db['patients'].update_one({"_id": ObjectId(patient_id)}, {"$set": {"ckd_stage": ckd_stage}})
+    return result.matched_count == 1
+
+def _validate_date(value, fmt, name):
+    """
+    Raises ValueError unless value matches fmt exactly.
+    Dates are compared as strings, so '2024-1-5' would silently give a wrong range.
+    """
+    try:
+        datetime.datetime.strptime(value, fmt)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be {fmt.replace('%Y', 'YYYY').replace('%m', 'MM').replace('%d', 'DD')}")
+    # strptime accepts '2024-1-5'; string comparison needs zero padding
+    if len(value) != len(datetime.date(2000, 1, 1).strftime(fmt)):
+        raise ValueError(f"{name} must be zero-padded, e.g. {datetime.date(2024, 1, 5).strftime(fmt)}")
+
+def _build_event(patient_obj_id, event_type, date, notes=None, labs=None):
+    """
+    Builds a timeline document. Lab values are kept as a flat
+    { metric: float } map so trends can be computed without parsing notes.
+    """
+    if event_type not in EVENT_TYPES:
+        raise ValueError(f"Unknown event type '{event_type}'. Expected one of {EVENT_TYPES}")
+    # Dates are stored as sortable 'YYYY-MM-DD' strings like last_visit
+    _validate_date(date, "%Y-%m-%d", "date")
+
+    event = {
+        "patient_id": patient_obj_id,
+        "date": date,
+        "type": event_type,
+        "notes": notes,
+        "created_at": datetime.datetime.utcnow(),
+    }
+    if labs:
+        if not isinstance(labs, dict):
+            raise ValueError("labs must be an object of { metric: value }")
+        unknown = [metric for metric in labs if metric not in LAB_UNITS]
+        if unknown:
+            raise ValueError(f"Unknown lab metrics {unknown}. Expected any of {list(LAB_UNITS)}")
+        try:
+            event["labs"] = {metric: float(value) for metric, value in labs.items()}
+        except (TypeError, ValueError):
+            raise ValueError("Lab values must be numbers")
+    return event
+
+def _serialize_event(event):
+    event['id'] = str(event['_id'])
+    event['patient_id'] = str(event['patient_id'])
+    if 'supersedes' in event:
+        event['supersedes'] = str(event['supersedes'])
+    del event['_id']
+    event.pop('created_at', None)
+    return event
+
+def add_patient_event(patient_id, event_type, date=None, notes=None, labs=None, supersedes=None):
+    """
+    Appends a visit / lab / dialysis event to a patient's timeline.
+    Events are never updated in place. To correct one, pass its id as
+    supersedes: the original is marked void (hidden from the timeline and
+    removed from lab rollups) and the new event takes its place.
+    Returns the new event's ID as a string.
+    """
+    db = get_db_connection()
+    obj_id = ObjectId(patient_id)
+    date = date if date else datetime.datetime.now().strftime("%Y-%m-%d")
+    event = _build_event(obj_id, event_type, date, notes, labs)
+    event['_id'] = ObjectId()
+
+    if supersedes:
+        if not ObjectId.is_valid(supersedes):
+            raise ValueError(f"Unknown event '{supersedes}'")
+        # Conditional update so an event can only be voided once
+        original = db['patient_events'].find_one_and_update(
+            {"_id": ObjectId(supersedes), "patient_id": obj_id, "voided_by": {"$exists": False}},
+            {"$set": {"voided_by": event['_id']}}
+        )
+        if not original:
+            raise ValueError(f"Unknown or already superseded event '{supersedes}'")
+        event['supersedes'] = original['_id']
+        if original.get('labs'):
+            _recompute_lab_rollups(db, obj_id, original['date'][:7], original['labs'].keys())
+
+    result = db['patient_events'].insert_one(event)
+    if event.get('labs'):
+        _update_lab_rollups(db, obj_id, date, event['labs'])
+    # Keep the patient card's last_visit current without rewriting history
+    db['patients'].update_one({"_id": obj_id, "last_visit": {"$lt": date}}, {"$set": {"last_visit": date}})
+    return str(result.inserted_id)
+
+def get_patient_events(patient_id, limit=HISTORY_PAGE_SIZE, cursor=None, start_date=None, end_date=None):
+    """
+    Retrieves a page of a patient's timeline, newest first.
+    cursor is the 'id' of the last event from the previous page.
+    start_date / end_date ('YYYY-MM-DD') bound the range inclusively.
+    Returns (events, next_cursor); next_cursor is None on the last page.
+    """
+    db = get_db_connection()
+    events_col = db['patient_events']
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+
+    # Superseded events stay in the collection for audit but are not shown
+    query = {"patient_id": ObjectId(patient_id), "voided_by": {"$exists": False}}
+    date_range = {}
+    if start_date:
+        _validate_date(start_date, "%Y-%m-%d", "start")
+        date_range["$gte"] = start_date
+    if end_date:
+        _validate_date(end_date, "%Y-%m-%d", "end")
+        date_range["$lte"] = end_date
+    if date_range:
+        query["date"] = date_range
+
+    if cursor:
+        last = events_col.find_one({"_id": ObjectId(cursor), "patient_id": query["patient_id"]}, {"date": 1})
+        if not last:
+            raise ValueError(f"Unknown cursor '{cursor}'")
+        # Keyset pagination on the (date, _id) index instead of skip()
+        query["$or"] = [
+            {"date": {"$lt": last['date']}},
+            {"date": last['date'], "_id": {"$lt": last['_id']}},
+        ]
+
+    # Fetch one extra to know whether another page exists
+    docs = list(events_col.find(query).sort([("date", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)]).limit(limit + 1))
+    has_more = len(docs) > limit
+    events = [_serialize_event(e) for e in docs[:limit]]
+    next_cursor = events[-1]['id'] if has_more else None
+    return events, next_cursor
+
+def _update_lab_rollups(db, patient_obj_id, date, labs):
+    """
+    Folds one event's lab values into the monthly rollups.
+    Kept as running sum / count / min / max so averages stay exact.
+    """
+    month = date[:7]
+    for metric, value in labs.items():
+        db['lab_rollups'].update_one(
+            {"_id": {"patient_id": patient_obj_id, "metric": metric, "month": month}},
+            {
+                "$inc": {"count": 1, "sum": value},
+                "$min": {"min": value},
+                "$max": {"max": value}
+            },
+            upsert=True
+        )
+
+def _recompute_lab_rollups(db, patient_obj_id, month, metrics):
+    """
+    Recomputes the given (patient, month) rollups from the non-voided events.
+    Used when an event is superseded, since min / max cannot be un-applied incrementally.
+    """
+    for metric in metrics:
+        rollup_id = {"patient_id": patient_obj_id, "metric": metric, "month": month}
+        values = [
+            e['labs'][metric] for e in db['patient_events'].find(
+                {
+                    "patient_id": patient_obj_id,
+                    "date": {"$regex": f"^{month}"},
+                    f"labs.{metric}": {"$exists": True},
+                    "voided_by": {"$exists": False}
+                },
+                {f"labs.{metric}": 1}
+            )
+        ]
+        if values:
+            db['lab_rollups'].replace_one(
+                {"_id": rollup_id},
+                {"count": len(values), "sum": sum(values), "min": min(values), "max": max(values)},
+                upsert=True
+            )
+        else:
+            db['lab_rollups'].delete_one({"_id": rollup_id})
+
+def rebuild_lab_rollups():
+    """
+    Recomputes lab_rollups from the full patient timeline in one pipeline.
+    Only needed for backfills; add_patient_event keeps rollups current.
+    """
+    db = get_db_connection()
+    db['lab_rollups'].delete_many({})
+    db['patient_events'].aggregate([
+        {"$match": {"labs": {"$exists": True}, "voided_by": {"$exists": False}}},
+        {"$project": {"patient_id": 1, "month": {"$substrCP": ["$date", 0, 7]}, "labs": {"$objectToArray": "$labs"}}},
+        {"$unwind": "$labs"},
+        {"$group": {
+            "_id": {"patient_id": "$patient_id", "metric": "$labs.k", "month": "$month"},
+            "count": {"$sum": 1},
+            "sum": {"$sum": "$labs.v"},
+            "min": {"$min": "$labs.v"},
+            "max": {"$max": "$labs.v"}
+        }},
+        {"$merge": {"into": "lab_rollups", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+
+def get_lab_trends(metric, patient_id=None, ckd_stage=None, start_month=None, end_month=None):
+    """
+    Monthly trend of a lab metric from the rollup collection.
+    Returns per-patient series (for patient_id, or every patient in the cohort)
+    and the cohort-wide series for ckd_stage, computed in a single aggregation.
+    Months are 'YYYY-MM'.
+    """
+    db = get_db_connection()
+
+    match = {"_id.metric": metric}
+    if patient_id:
+        match["_id.patient_id"] = ObjectId(patient_id)
+    month_range = {}
+    if start_month:
+        _validate_date(start_month, "%Y-%m", "start")
+        month_range["$gte"] = start_month
+    if end_month:
+        _validate_date(end_month, "%Y-%m", "end")
+        month_range["$lte"] = end_month
+    if month_range:
+        match["_id.month"] = month_range
+
+    pipeline = [{"$match": match}]
+    if ckd_stage is not None:
+        # Stage is read from the patient at query time so re-staging a patient
+        # never leaves stale rollups behind
+        pipeline += [
+            {"$lookup": {"from": "patients", "localField": "_id.patient_id", "foreignField": "_id", "as": "patient"}},
+            {"$match": {"patient.ckd_stage": ckd_stage}}
+        ]
+
+    point = {
+        "month": "$_id.month",
+        "avg": {"$round": [{"$divide": ["$sum", "$count"]}, 2]},
+        "min": "$min",
+        "max": "$max",
+        "count": "$count"
+    }
+    pipeline.append({"$facet": {
+        "patients": [
+            {"$sort": {"_id.month": 1}},
+            {"$group": {"_id": "$_id.patient_id", "points": {"$push": point}}}
+        ],
+        "cohort": [
+            {"$group": {
+                "_id": "$_id.month",
+                "sum": {"$sum": "$sum"},
+                "count": {"$sum": "$count"},
+                "min": {"$min": "$min"},
+                "max": {"$max": "$max"},
+                "patients": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}},
+            {"$project": {
+                "_id": 0,
+                "month": "$_id",
+                "avg": {"$round": [{"$divide": ["$sum", "$count"]}, 2]},
+                "min": 1,
+                "max": 1,
+                "count": 1,
+                "patients": 1
+            }}
+        ]
+    }})
+
+    result = next(db['lab_rollups'].aggregate(pipeline), {"patients": [], "cohort": []})
+    return {
+        "metric": metric,
+        "unit": LAB_UNITS.get(metric),
+        "patients": {str(p['_id']): p['points'] for p in result['patients']},
+        "cohort": result['cohort']
+    }
@@ -1,26 +1,29 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, jsonify, send_from_directory, Response, stream_with_context, abort, make_response
 import os
 from dotenv import load_dotenv
 load_dotenv()
-from rag_service import RAGService
 from pdf_service import PDFReportGenerator
-from calendar_service import CalendarService
+from event_service import SlotEventBroadcaster
+from doctor_registry import DoctorRegistry
 
-app = Flask(__name__)
-
-# Initialize Services
-rag_service = RAGService()
-pdf_generator = PDFReportGenerator()
-calendar_service = CalendarService() # Will print warning if credentials missing
-
-from database import init_db, get_all_patients, get_patient
+from database import init_db, get_all_patients, get_patient, get_patient_events, add_patient_event, HISTORY_PAGE_SIZE, get_lab_trends, LAB_UNITS, CKD_STAGES, set_patient_ckd_stage
+from bson.objectid import ObjectId
 
 app = Flask(__name__)
 
 # Initialize Services
-rag_service = RAGService()
 pdf_generator = PDFReportGenerator()
-calendar_service = CalendarService() # Will print warning if credentials missing
+slot_events = SlotEventBroadcaster()
+# Per-doctor calendars and RAG flows; services print warnings if credentials missing
+doctor_registry = DoctorRegistry(broadcaster=slot_events)
+
+def current_doctor():
+    """Resolves the doctor from ?doctor=<id> or the JSON body; falls back to the default doctor"""
+    doctor_id = request.args.get('doctor') or (request.get_json(silent=True) or {}).get('doctor')
+    doctor = doctor_registry.get(doctor_id)
+    if not doctor:
+        abort(make_response(jsonify({"error": f"Unknown doctor '{doctor_id}'"}), 404))
+    return doctor
 
 # Initialize DB
 try:
@@ -38,10 +41,95 @@ def get_patients_route():
 
 @app.route('/api/patients/<patient_id>/history', methods=['GET'])
 def get_patient_history(patient_id):
+    # Patient summary plus one page of the timeline.
+    # Query params: limit, cursor (last event id), start / end (YYYY-MM-DD)
     patient = get_patient(patient_id)
-    if patient:
-        return jsonify(patient)
-    return jsonify({"error": "Patient not found"}), 404
+    if not patient:
+        return jsonify({"error": "Patient not found"}), 404
+
+    try:
+        limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+        events, next_cursor = get_patient_events(
+            patient_id,
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            start_date=request.args.get('start'),
+            end_date=request.args.get('end')
+        )
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    patient['events'] = events
+    patient['next_cursor'] = next_cursor
+    return jsonify(patient)
+
+@app.route('/api/patients/<patient_id>/history', methods=['POST'])
+def add_patient_history(patient_id):
+    # Body: { type, date, notes, labs, supersedes } — supersedes voids an earlier (mistaken) event
+    data = request.json
+    event_type = data.get('type')
+    if not event_type:
+        return jsonify({"error": "Event type required"}), 400
+    if not get_patient(patient_id):
+        return jsonify({"error": "Patient not found"}), 404
+
+    try:
+        event_id = add_patient_event(
+            patient_id,
+            event_type,
+            date=data.get('date'),
+            notes=data.get('notes'),
+            labs=data.get('labs'),
+            supersedes=data.get('supersedes')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"status": "success", "id": event_id}), 201
+
+@app.route('/api/patients/<patient_id>/ckd_stage', methods=['PUT'])
+def update_ckd_stage(patient_id):
+    # Body: { "ckd_stage": 1-5 or null }
+    data = request.json
+    if 'ckd_stage' not in data:
+        return jsonify({"error": "ckd_stage required"}), 400
+    if not ObjectId.is_valid(patient_id):
+        return jsonify({"error": "Patient not found"}), 404
+
+    try:
+        found = set_patient_ckd_stage(patient_id, data.get('ckd_stage'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not found:
+        return jsonify({"error": "Patient not found"}), 404
+    return jsonify({"status": "success"})
+
+@app.route('/api/analytics/labs', methods=['GET'])
+def lab_trends():
+    # e.g. ?metric=egfr&stage=3 for the Stage 3 cohort, or ?metric=creatinine&patient_id=...
+    metric = request.args.get('metric')
+    if metric not in LAB_UNITS:
+        return jsonify({"error": f"Metric must be one of {list(LAB_UNITS)}"}), 400
+
+    stage = request.args.get('stage')
+    if stage and stage not in [str(s) for s in CKD_STAGES]:
+        return jsonify({"error": f"Stage must be one of {list(CKD_STAGES)}"}), 400
+    patient_id = request.args.get('patient_id')
+    if patient_id and not ObjectId.is_valid(patient_id):
+        return jsonify({"error": "Invalid patient ID"}), 400
+
+    try:
+        trends = get_lab_trends(
+            metric,
+            patient_id=patient_id,
+            ckd_stage=int(stage) if stage else None,
+            start_month=request.args.get('start'),
+            end_month=request.args.get('end')
+        )
+        return jsonify(trends)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/rag/query', methods=['POST'])
 def query_rag():
@@ -50,7 +138,7 @@ def query_rag():
     if not message:
         return jsonify({"error": "Message required"}), 400
     
-    response = rag_service.query_agent(message)
+    response = current_doctor().rag.query_agent(message)
     return jsonify({"response": response})
 
 @app.route('/api/medicine/recommend', methods=['POST'])
@@ -60,8 +148,9 @@ def recommend_medicine():
     if not condition:
         return jsonify({"error": "Condition required"}), 400
 
-    recommendations = rag_service.get_medicine_recommendations(condition)
-    return jsonify({"recommendations": recommendations})
+    # refresh=true skips the semantic cache and always asks the agent
+    recommendations, cache_info = current_doctor().rag.get_medicine_recommendations(condition, use_cache=not data.get('refresh'))
+    return jsonify({"recommendations": recommendations, "cached": cache_info is not None, "cache": cache_info})
 
 @app.route('/api/medicine/generate_pdf', methods=['POST'])
 def generate_medicine_pdf():
@@ -72,8 +161,9 @@ def generate_medicine_pdf():
     if not condition or not recommendation:
         return jsonify({"error": "Condition and recommendation required"}), 400
 
+    doctor = current_doctor()
     try:
-        pdf_path = pdf_generator.generate_medicine_report(condition, recommendation)
+        pdf_path = pdf_generator.generate_medicine_report(condition, recommendation, doctor_name=doctor.name)
         
         # Return relative path for frontend to download
         relative_path = os.path.relpath(pdf_path, start=os.getcwd())
@@ -90,10 +180,23 @@ def serve_report(filename):
 
 
 
+@app.route('/api/doctors', methods=['GET'])
+def list_doctors():
+    return jsonify(doctor_registry.list_doctors())
+
+@app.route('/api/calendar/clinic/slots', methods=['GET'])
+def get_clinic_slots():
+    # Clinic-wide view: every doctor's available slots, fetched concurrently
+    date_str = request.args.get('date')
+    if not date_str:
+        return jsonify({"error": "Date required"}), 400
+    return jsonify(doctor_registry.get_clinic_availability(date_str))
+
 @app.route('/api/calendar/events', methods=['GET'])
 def get_events():
+    doctor = current_doctor()
     try:
-        events = calendar_service.get_upcoming_events()
+        events = doctor.calendar.get_upcoming_events()
         return jsonify(events)
     except Exception as e:
          return jsonify({"error": str(e)}), 500
@@ -106,8 +209,9 @@ def get_slots():
     date_str = request.args.get('date')
     if not date_str:
         return jsonify({"error": "Date required"}), 400
+    doctor = current_doctor()
     try:
-        slots = calendar_service.get_available_slots(date_str)
+        slots = doctor.calendar.get_available_slots(date_str)
         return jsonify(slots)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -117,12 +221,26 @@ def get_manageable_slots():
     # For Doctor Dashboard
     date_str = request.args.get('date')
     if not date_str: return jsonify({"error": "Date required"}), 400
+    doctor = current_doctor()
     try:
-        status_map = calendar_service.get_slot_status(date_str)
+        status_map = doctor.calendar.get_slot_status(date_str)
         return jsonify(status_map)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/calendar/stream', methods=['GET'])
+def stream_slot_updates():
+    # Server-Sent Events: pushes slot deltas made elsewhere to open dashboards.
+    # Streams are capped; dashboards still refresh their own changes without it.
+    doctor = current_doctor()
+    subscriber = slot_events.subscribe(doctor_id=doctor.id)
+    if subscriber is None:
+        return jsonify({"error": "Too many open slot streams"}), 503
+    response = Response(stream_with_context(slot_events.stream(subscriber)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/api/calendar/manage/toggle', methods=['POST'])
 def toggle_slot():
     data = request.json
@@ -133,7 +251,7 @@ def toggle_slot():
     if not all([date_str, time_str, action]):
         return jsonify({"error": "Missing fields"}), 400
         
-    success, msg = calendar_service.toggle_slot(date_str, time_str, action)
+    success, msg = current_doctor().calendar.toggle_slot(date_str, time_str, action)
     if success:
         return jsonify({"status": "success", "message": msg})
     else:
@@ -148,7 +266,7 @@ def book_appointment():
     if not start_time:
          return jsonify({"error": "Start time required"}), 400
 
-    success, result = calendar_service.book_slot(start_time, summary=summary)
+    success, result = current_doctor().calendar.book_slot(start_time, summary=summary)
     
     if success:
         return jsonify({"status": "success", "link": result})
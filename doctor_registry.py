@@ -0,0 +1,114 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from calendar_service import CalendarService
+from rag_service import RAGService
+
+# Used when DOCTORS_CONFIG is not set: the original single-doctor setup
+DEFAULT_DOCTORS = [
+    {
+        "id": "raje",
+        "name": "Dr. Raje",
+        "calendar_id": "primary",
+        "token_env": "GOOGLE_TOKEN_JSON",
+        "token_path": "token.json"
+    }
+]
+
+class DoctorContext:
+    """
+    Everything that belongs to one doctor: their calendar (with its own
+    credentials, timezone and slot caches) and their Langflow flow.
+    Services are built at startup, as before, so a missing token never
+    starts the interactive OAuth flow inside a request thread.
+    """
+    def __init__(self, config, broadcaster=None):
+        self.id = config['id']
+        self.name = config.get('name', self.id)
+        self.config = config
+        self.calendar = CalendarService(
+            credentials_path=config.get('credentials_path', 'credentials.json'),
+            token_path=config.get('token_path', f"token_{self.id}.json"),
+            broadcaster=broadcaster,
+            calendar_id=config.get('calendar_id', 'primary'),
+            token_env=config.get('token_env', f"GOOGLE_TOKEN_JSON_{self.id.upper()}"),
+            doctor_id=self.id
+        )
+        self.rag = RAGService(
+            flow_url=config.get('langflow_flow_url'),
+            org_id=config.get('langflow_org_id'),
+            api_token=os.getenv(config['langflow_token_env']) if config.get('langflow_token_env') else None
+        )
+
+    def to_dict(self):
+        return {"id": self.id, "name": self.name}
+
+class DoctorRegistry:
+    """
+    Tenant registry: maps doctor IDs to their DoctorContext.
+    Config comes from the DOCTORS_CONFIG env var (JSON list) or a doctors.json
+    file next to this module, e.g.
+    [{"id": "raje", "name": "Dr. Raje", "calendar_id": "primary",
+      "token_env": "GOOGLE_TOKEN_JSON", "langflow_flow_url": "https://..."}]
+    """
+    def __init__(self, broadcaster=None, config_path="doctors.json", max_workers=8):
+        self.broadcaster = broadcaster
+        self.max_workers = max_workers
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.config_path = os.path.join(base_dir, config_path)
+        self.doctors = {}
+        for config in self._load_config():
+            self.doctors[config['id']] = DoctorContext(config, broadcaster)
+        self.default_id = next(iter(self.doctors))
+
+    def _load_config(self):
+        config_env = os.getenv("DOCTORS_CONFIG")
+        if config_env:
+            try:
+                return self._validate_config(json.loads(config_env))
+            except Exception as e:
+                print(f"Error parsing DOCTORS_CONFIG: {e}. Falling back to the default doctor.")
+        elif os.path.exists(self.config_path):
+            try:
+                with open(self.config_path) as f:
+                    return self._validate_config(json.load(f))
+            except Exception as e:
+                print(f"Error loading {self.config_path}: {e}. Falling back to the default doctor.")
+        return DEFAULT_DOCTORS
+
+    def _validate_config(self, config):
+        """Config must be a non-empty list of objects, each with a unique 'id'"""
+        if not isinstance(config, list) or not config:
+            raise ValueError("expected a non-empty list of doctors")
+        ids = set()
+        for entry in config:
+            if not isinstance(entry, dict) or not isinstance(entry.get('id'), str) or not entry['id']:
+                raise ValueError(f"doctor entry without a string 'id': {entry}")
+            if entry['id'] in ids:
+                raise ValueError(f"duplicate doctor id '{entry['id']}'")
+            ids.add(entry['id'])
+        return config
+
+    def get(self, doctor_id=None):
+        """Returns the doctor's context, the default doctor if no ID is given, or None if unknown"""
+        return self.doctors.get(doctor_id or self.default_id)
+
+    def list_doctors(self):
+        return [doctor.to_dict() for doctor in self.doctors.values()]
+
+    def get_clinic_availability(self, date_str):
+        """
+        Available slots for every doctor on a date.
+        Calendars are fetched concurrently, one thread per doctor; calls on
+        the same calendar are serialized by CalendarService itself.
+        Returns { doctor_id: { 'name': ..., 'slots': [...] } }
+        """
+        def fetch(doctor):
+            try:
+                return doctor.id, {"name": doctor.name, "slots": doctor.calendar.get_available_slots(date_str)}
+            except Exception as e:
+                return doctor.id, {"name": doctor.name, "slots": [], "error": str(e)}
+
+        doctors = list(self.doctors.values())
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(doctors))) as pool:
+            return dict(pool.map(fetch, doctors))
@@ -0,0 +1,84 @@
+import json
+import time
+import queue
+import threading
+
+class SlotEventBroadcaster:
+    """
+    In-process pub/sub for calendar slot changes.
+    Each connected dashboard gets its own queue; publishers push small
+    deltas of the form { 'date': 'YYYY-MM-DD', 'doctor': id, 'slots': { time: { status, details } } }
+
+    Every open stream holds a worker thread, so the number of streams is
+    capped (max_subscribers) and each stream ends after max_stream_seconds;
+    the browser's EventSource reconnects on its own. Keep max_subscribers
+    well below the Gunicorn thread count (see Dockerfile).
+    """
+    def __init__(self, max_queue_size=100, keepalive_seconds=15, max_subscribers=8, max_stream_seconds=300):
+        self.max_queue_size = max_queue_size
+        self.keepalive_seconds = keepalive_seconds
+        self.max_subscribers = max_subscribers
+        self.max_stream_seconds = max_stream_seconds
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, doctor_id=None):
+        """
+        Returns a new subscriber queue, or None if the stream limit is reached.
+        The subscriber only receives deltas for doctor_id's calendar.
+        """
+        q = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.append((q, doctor_id))
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers = [(sub, doctor_id) for sub, doctor_id in self._subscribers if sub is not q]
+
+    def publish(self, date_str, slots, doctor_id=None):
+        """Push a slot delta to the clients watching this doctor. Empty deltas are dropped."""
+        if not slots:
+            return
+        delta = {'date': date_str, 'slots': slots, 'doctor': doctor_id}
+        with self._lock:
+            # Filtered here so one doctor's patient names never reach another doctor's dashboard
+            subscribers = [q for q, sub_doctor in self._subscribers if sub_doctor == doctor_id]
+        for q in subscribers:
+            try:
+                q.put_nowait(delta)
+            except queue.Full:
+                # Slow client: drop it and end its stream so the browser's EventSource
+                # reconnects (and resyncs) instead of idling on keepalives
+                self.unsubscribe(q)
+                self._close(q)
+
+    def _close(self, q):
+        """Replaces a dropped subscriber's backlog with the end-of-stream sentinel"""
+        try:
+            while True:
+                q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(None)
+
+    def stream(self, q):
+        """Generator yielding Server-Sent Events for one subscribed client."""
+        deadline = time.time() + self.max_stream_seconds
+        try:
+            yield "retry: 3000\n\n"
+            while time.time() < deadline:
+                try:
+                    delta = q.get(timeout=self.keepalive_seconds)
+                except queue.Empty:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                if delta is None:
+                    # Dropped by publish(); returning frees this worker thread
+                    return
+                yield f"event: slots\ndata: {json.dumps(delta)}\n\n"
+        finally:
+            self.unsubscribe(q)
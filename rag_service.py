@@ -1,13 +1,26 @@
 import os
 import requests
 from dotenv import load_dotenv
+from semantic_cache import SemanticCache
 
 load_dotenv()
 
+# Default Langflow flow for the Doctor App
+DEFAULT_FLOW_URL = "https://aws-us-east-2.langflow.datastax.com/lf/5db4f5b7-e030-4086-b5c5-b8dbd45a42c1/api/v1/run/cce9bd23-a780-4afd-96cd-4dfb83e183df"
+DEFAULT_ORG_ID = "d9534c49-4182-4860-85ea-1af8d3b41043"
+
 class RAGService:
-    def __init__(self):
+    def __init__(self, flow_url=None, org_id=None, api_token=None):
         self.api_url = os.getenv("LANGFLOW_URL")
-        self.api_token = os.getenv("LANGFLOW_API_TOKEN")
+        self.api_token = api_token or os.getenv("LANGFLOW_API_TOKEN")
+        self.flow_url = flow_url or DEFAULT_FLOW_URL
+        self.org_id = org_id or DEFAULT_ORG_ID
+        # Per-flow cache of medicine recommendations, keyed by condition similarity
+        self.recommendation_cache = SemanticCache(
+            threshold=float(os.getenv("RECOMMENDATION_CACHE_THRESHOLD", "0.9")),
+            ttl_seconds=int(os.getenv("RECOMMENDATION_CACHE_TTL", str(24 * 3600))),
+            max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "256"))
+        )
         
         if not self.api_token:
             print("Warning: LANGFLOW_API_TOKEN not found in environment variables")
@@ -18,9 +31,16 @@ class RAGService:
         """
         Sends a message to the Langflow agent and returns the response.
         """
-        # Configuration provided by user for Doctor App
-        api_url = "https://aws-us-east-2.langflow.datastax.com/lf/5db4f5b7-e030-4086-b5c5-b8dbd45a42c1/api/v1/run/cce9bd23-a780-4afd-96cd-4dfb83e183df"
-        org_id = "d9534c49-4182-4860-85ea-1af8d3b41043"
+        return self._run_agent(message, tweaks)[1]
+
+    def _run_agent(self, message, tweaks=None):
+        """
+        Calls the Langflow agent.
+        Returns (success, text); on failure text is a user-facing error message.
+        """
+        # Flow is per doctor (see doctor_registry)
+        api_url = self.flow_url
+        org_id = self.org_id
         
         # Use env var token if available, otherwise warn
         if not self.api_token:
@@ -53,23 +73,34 @@ class RAGService:
                 if outputs:
                     result = outputs[0]['outputs'][0]['results']['message']
                     if isinstance(result, dict) and 'text' in result:
-                        return result['text']
+                        return True, result['text']
                     elif hasattr(result, 'data') and 'text' in result.data:
-                         return result.data['text']
+                         return True, result.data['text']
                     else:
-                         return str(result)
-                return "No response from agent."
+                         return True, str(result)
+                return False, "No response from agent."
             except (KeyError, IndexError, TypeError) as e:
                 print(f"Error parsing Langflow response: {e}")
-                return "Error parsing agent response."
+                return False, "Error parsing agent response."
 
         except requests.exceptions.RequestException as e:
             print(f"RAG Service Error: {e}")
-            return f"Error connecting to AI agent: {str(e)}"
+            return False, f"Error connecting to AI agent: {str(e)}"
 
-    def get_medicine_recommendations(self, condition):
+    def get_medicine_recommendations(self, condition, use_cache=True):
         """
         Asks the agent for medicine recommendations based on a condition.
+        Paraphrases of a recently asked condition are answered from the local semantic cache.
+        Returns (recommendations, cache_info); cache_info is None when the agent was queried.
         """
+        if use_cache:
+            hit = self.recommendation_cache.get(condition)
+            if hit:
+                return hit['response'], {"similarity": hit['similarity'], "matched_condition": hit['matched_text']}
+
         prompt = f"Suggest standard medicines and treatments for the following condition, keeping in mind CKD (Chronic Kidney Disease) constraints if applicable: {condition}. Provide a concise list."
-        return self.query_agent(prompt)
+        success, recommendations = self._run_agent(prompt)
+        # Only cache real answers, never connection or parsing errors
+        if success:
+            self.recommendation_cache.put(condition, recommendations)
+        return recommendations, None
@@ -0,0 +1,151 @@
+import re
+import time
+import threading
+from collections import Counter
+import numpy as np
+
+# Words that carry no clinical meaning for matching conditions
+STOPWORDS = {"a", "an", "and", "the", "with", "of", "in", "on", "for", "to", "patient", "has", "having"}
+# Roman numerals are common for CKD stages ("stage III")
+ROMAN_NUMERALS = {"i": "1", "ii": "2", "iii": "3", "iv": "4", "v": "5"}
+# Common spellings of the same clinical term, mapped to one token
+SYNONYMS = {
+    "chronic kidney disease": "ckd",
+    "htn": "hypertension",
+    "hypertensive": "hypertension",
+    "dm": "diabetes",
+    "diabetic": "diabetes",
+    "anaemia": "anemia",
+}
+
+class SemanticCache:
+    """
+    Local similarity cache for LLM answers.
+    Prompts are normalized (order, stopwords, roman numerals, common
+    synonyms) and ranked by TF-IDF cosine similarity in NumPy, so paraphrases
+    like "stage 3 CKD with hypertension" and "hypertension, CKD stage III"
+    hit the same entry. A hit also requires exactly the same set of clinical
+    terms: an added or dropped comorbidity, or a different stage, is a miss
+    however high the score, since the answer is prescription advice.
+    Entries expire after ttl_seconds; when full, the least recently used
+    entry is evicted.
+    """
+    def __init__(self, threshold=0.9, ttl_seconds=24 * 3600, max_entries=256):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = []  # dicts: text, terms, response, expires_at, last_used
+        self._vocab = {}  # token -> column in _counts
+        self._counts = np.zeros((0, 0), dtype=np.float32)  # raw term counts, one row per entry
+        self._lock = threading.Lock()
+
+    def _tokenize(self, text):
+        text = text.lower()
+        for phrase, canonical in SYNONYMS.items():
+            text = re.sub(rf"\b{phrase}\b", canonical, text)
+        tokens = re.findall(r"[a-z]+|\d+(?:\.\d+)?", text)
+        tokens = [ROMAN_NUMERALS.get(t, t) for t in tokens]
+        return [t for t in tokens if t not in STOPWORDS]
+
+    def _rebuild(self):
+        """
+        Rebuilds the vocabulary and count matrix from the current entries.
+        The cache is small (max_entries short prompts), so this is cheap and
+        keeps the vocabulary from growing past what is actually cached.
+        """
+        self._vocab = {}
+        for entry in self._entries:
+            for token in entry['terms']:
+                self._vocab.setdefault(token, len(self._vocab))
+        self._counts = np.zeros((len(self._entries), len(self._vocab)), dtype=np.float32)
+        for row, entry in enumerate(self._entries):
+            for token, count in entry['terms'].items():
+                self._counts[row, self._vocab[token]] = count
+
+    def _idf(self):
+        # Smoothed IDF over the cached prompts
+        df = np.count_nonzero(self._counts, axis=0)
+        n = len(self._entries)
+        return np.log((1 + n) / (1 + df)) + 1
+
+    def _purge_expired(self, now):
+        keep = [e for e in self._entries if e['expires_at'] > now]
+        if len(keep) != len(self._entries):
+            self._entries = keep
+            self._rebuild()
+
+    def get(self, text):
+        """
+        Returns { 'response', 'similarity', 'matched_text' } for the closest
+        cached prompt above the threshold, or None.
+        """
+        tokens = self._tokenize(text)
+        if not tokens:
+            return None
+        terms = set(tokens)
+
+        with self._lock:
+            now = time.time()
+            self._purge_expired(now)
+            if not self._entries:
+                return None
+
+            idf = self._idf()
+            matrix = np.log1p(self._counts) * idf
+            matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+            # Words never seen in the cache have no column but still count
+            # towards the query's norm, so they lower the similarity
+            query = np.zeros(len(self._vocab), dtype=np.float32)
+            unseen_sq = 0.0
+            unseen_idf = np.log(1 + len(self._entries)) + 1
+            for token, count in Counter(tokens).items():
+                if token in self._vocab:
+                    col = self._vocab[token]
+                    query[col] = np.log1p(count) * idf[col]
+                else:
+                    unseen_sq += (np.log1p(count) * unseen_idf) ** 2
+            query_norm = np.sqrt(float(query @ query) + unseen_sq)
+            scores = (matrix @ query) / max(query_norm, 1e-12)
+
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                entry = self._entries[i]
+                # Common terms get little IDF weight, so the score alone cannot tell
+                # "CKD with anemia" from "anemia"; every term must match
+                if set(entry['terms']) != terms:
+                    continue
+                entry['last_used'] = now
+                return {
+                    "response": entry['response'],
+                    "similarity": round(float(scores[i]), 3),
+                    "matched_text": entry['text']
+                }
+        return None
+
+    def put(self, text, response):
+        tokens = self._tokenize(text)
+        if not tokens:
+            return
+
+        with self._lock:
+            now = time.time()
+            self._purge_expired(now)
+            if len(self._entries) >= self.max_entries:
+                lru = min(range(len(self._entries)), key=lambda i: self._entries[i]['last_used'])
+                del self._entries[lru]
+
+            self._entries.append({
+                "text": text,
+                "terms": Counter(tokens),
+                "response": response,
+                "expires_at": now + self.ttl_seconds,
+                "last_used": now
+            })
+            self._rebuild()
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self._rebuild()
@@ -2,12 +2,52 @@
 let currentTab = 'patients';
 let currentPrescriptionAnalysis = '';
 let currentPatientName = '';
+let currentDoctorId = null; // null = server default doctor
 
 // Initialization
 document.addEventListener('DOMContentLoaded', () => {
     switchTab('patients');
+    loadDoctors();
 });
 
+// --- Doctor Selection ---
+function loadDoctors() {
+    const select = document.getElementById('doctor-select');
+    if (!select) return;
+
+    fetch('/api/doctors')
+        .then(res => res.json())
+        .then(doctors => {
+            select.innerHTML = '';
+            doctors.forEach(doctor => {
+                const opt = document.createElement('option');
+                opt.value = doctor.id;
+                opt.innerText = doctor.name;
+                select.appendChild(opt);
+            });
+            if (doctors.length) currentDoctorId = doctors[0].id;
+            // Hide the selector for single-doctor setups
+            select.parentElement.style.display = doctors.length > 1 ? 'block' : 'none';
+            subscribeSlotUpdates();
+        })
+        .catch(err => {
+            console.error(err);
+            subscribeSlotUpdates();
+        });
+}
+
+function switchDoctor() {
+    currentDoctorId = document.getElementById('doctor-select').value;
+    subscribeSlotUpdates();
+    if (currentTab === 'calendar') loaddocSlots();
+}
+
+// Adds ?doctor=<id> to API URLs
+function withDoctor(url) {
+    if (!currentDoctorId) return url;
+    return url + (url.includes('?') ? '&' : '?') + `doctor=${encodeURIComponent(currentDoctorId)}`;
+}
+
 // Tab Switching
 function switchTab(tabId) {
     // Update UI
@@ -64,10 +104,79 @@ function showPatientDetails(id) {
             document.getElementById('modal-patient-visit').innerText = patient.last_visit;
             document.getElementById('modal-patient-history').innerText = patient.history;
 
+            currentHistoryPatientId = id;
+            document.getElementById('modal-patient-timeline').innerHTML = '';
+            renderTimeline(patient.events, patient.next_cursor);
+            loadPatientTrend(id);
+
             document.getElementById('patient-modal').style.display = 'block';
         });
 }
 
+function loadPatientTrend(id) {
+    const trendBox = document.getElementById('modal-patient-trend');
+    trendBox.innerText = '';
+
+    fetch(`/api/analytics/labs?metric=egfr&patient_id=${id}`)
+        .then(res => res.json())
+        .then(data => {
+            const points = (data.patients || {})[id] || [];
+            if (points.length === 0) return;
+            trendBox.innerText = 'eGFR trend: ' + points.map(p => `${p.month}: ${p.avg}`).join(' \u2192 ');
+        })
+        .catch(err => console.error(err));
+}
+
+// Timeline pagination state
+let currentHistoryPatientId = null;
+let currentHistoryCursor = null;
+
+function loadMoreHistory() {
+    if (!currentHistoryPatientId || !currentHistoryCursor) return;
+
+    fetch(`/api/patients/${currentHistoryPatientId}/history?cursor=${currentHistoryCursor}`)
+        .then(res => res.json())
+        .then(data => renderTimeline(data.events, data.next_cursor))
+        .catch(err => console.error(err));
+}
+
+function renderTimeline(events, nextCursor) {
+    const timeline = document.getElementById('modal-patient-timeline');
+    const moreBtn = document.getElementById('timeline-more-btn');
+
+    (events || []).forEach(event => {
+        const item = document.createElement('div');
+        item.className = `timeline-item ${event.type}`;
+
+        // Notes are free text, so every part is set as text rather than HTML
+        const dateDiv = document.createElement('div');
+        dateDiv.className = 'timeline-date';
+        dateDiv.textContent = `${event.date} \u00b7 ${event.type.toUpperCase()}`;
+        item.appendChild(dateDiv);
+
+        if (event.notes) {
+            const notesDiv = document.createElement('div');
+            notesDiv.className = 'timeline-notes';
+            notesDiv.textContent = event.notes;
+            item.appendChild(notesDiv);
+        }
+
+        if (event.labs) {
+            const labsDiv = document.createElement('div');
+            labsDiv.className = 'timeline-labs';
+            labsDiv.textContent = Object.keys(event.labs).map(metric => `${metric}: ${event.labs[metric]}`).join(' | ');
+            item.appendChild(labsDiv);
+        }
+
+        timeline.appendChild(item);
+    });
+
+    if (timeline.children.length === 0) timeline.innerHTML = '<p>No recorded events.</p>';
+
+    currentHistoryCursor = nextCursor;
+    moreBtn.style.display = nextCursor ? 'inline-block' : 'none';
+}
+
 function closeModal() {
     document.getElementById('patient-modal').style.display = 'none';
 }
@@ -102,7 +211,7 @@ function sendMessage() {
     fetch('/api/rag/query', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ message: msg })
+        body: JSON.stringify({ message: msg, doctor: currentDoctorId })
     })
         .then(res => res.json())
         .then(data => {
@@ -150,26 +259,40 @@ function analyzePrescription() {
 // Global variables
 let currentMedicineRec = '';
 
-function getMedicineRecommendations() {
+function getMedicineRecommendations(refresh = false) {
     const condition = document.getElementById('med-condition').value;
     const resultBox = document.getElementById('med-recommendations');
     const btn = document.getElementById('download-med-pdf-btn');
+    const cacheNote = document.getElementById('med-cache-note');
 
     if (!condition.trim()) return alert("Enter a condition.");
 
     resultBox.innerText = "Consulting AI...";
     if (btn) btn.disabled = true;
+    if (cacheNote) cacheNote.style.display = 'none';
 
     fetch('/api/medicine/recommend', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ condition: condition })
+        body: JSON.stringify({ condition: condition, doctor: currentDoctorId, refresh: refresh })
     })
         .then(res => res.json())
         .then(data => {
             currentMedicineRec = data.recommendations;
             resultBox.innerText = data.recommendations;
             if (btn) btn.disabled = false;
+
+            // Tell the doctor when the answer was reused for a similar condition
+            if (cacheNote && data.cached) {
+                const match = Math.round(data.cache.similarity * 100);
+                cacheNote.innerText = `Served from cache (${match}% match with "${data.cache.matched_condition}"). `;
+                const retry = document.createElement('a');
+                retry.href = '#';
+                retry.innerText = 'Ask AI again';
+                retry.onclick = () => { getMedicineRecommendations(true); return false; };
+                cacheNote.appendChild(retry);
+                cacheNote.style.display = 'block';
+            }
         })
         .catch(err => {
             resultBox.innerText = "Failed to get recommendations.";
@@ -187,7 +310,8 @@ function downloadMedicinePDF() {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
             condition: condition,
-            recommendation: currentMedicineRec
+            recommendation: currentMedicineRec,
+            doctor: currentDoctorId
         })
     })
         .then(res => res.json())
@@ -214,7 +338,7 @@ function loaddocSlots() {
     if (containerMorning) containerMorning.innerHTML = 'Loading...';
     if (containerEvening) containerEvening.innerHTML = 'Loading...';
 
-    fetch(`/api/calendar/manage/status?date=${date}`)
+    fetch(withDoctor(`/api/calendar/manage/status?date=${date}`))
         .then(res => res.json())
         .then(statusMap => {
             if (containerMorning) containerMorning.innerHTML = '';
@@ -229,33 +353,7 @@ function loaddocSlots() {
             const sortedTimes = Object.keys(statusMap).sort();
 
             sortedTimes.forEach(time => {
-                const slotData = statusMap[time]; // { status, details }
-                const status = slotData.status; // 'available', 'booked', 'blocked'
-                const details = slotData.details;
-
-                const card = document.createElement('div');
-                card.className = `slot-card ${status}`;
-
-                let actionBtn = '';
-                let detailsHtml = '';
-
-                if (status === 'available') {
-                    actionBtn = `<button onclick="toggleSlot('${date}', '${time}', 'block')">Mark Unavailable</button>`;
-                } else if (status === 'blocked') {
-                    actionBtn = `<button onclick="toggleSlot('${date}', '${time}', 'unblock')">Mark Available</button>`;
-                } else if (status === 'booked') {
-                    // Show patient name if available, else just 'Booked'
-                    const patientName = details || 'Unknown Patient';
-                    detailsHtml = `<div class="patient-name">${patientName}</div>`;
-                    actionBtn = `<span>Booked</span>`;
-                }
-
-                card.innerHTML = `
-                    <div class="slot-time">${time}</div>
-                    ${detailsHtml}
-                    <div class="slot-status">${status.toUpperCase()}</div>
-                    <div class="slot-action">${actionBtn}</div>
-                `;
+                const card = renderSlotCard(date, time, statusMap[time]);
 
                 // Determine Morning vs Evening
                 const hour = parseInt(time.split(':')[0]);
@@ -277,16 +375,54 @@ function loaddocSlots() {
         });
 }
 
+function renderSlotCard(date, time, slotData) {
+    const status = slotData.status; // 'available', 'booked', 'blocked'
+    const details = slotData.details;
+
+    const card = document.createElement('div');
+    card.className = `slot-card ${status}`;
+    card.dataset.time = time;
+
+    let actionBtn = '';
+    let detailsHtml = '';
+
+    if (status === 'available') {
+        actionBtn = `<button onclick="toggleSlot('${date}', '${time}', 'block')">Mark Unavailable</button>`;
+    } else if (status === 'blocked') {
+        actionBtn = `<button onclick="toggleSlot('${date}', '${time}', 'unblock')">Mark Available</button>`;
+    } else if (status === 'booked') {
+        // Show patient name if available, else just 'Booked'
+        const patientName = details || 'Unknown Patient';
+        detailsHtml = `<div class="patient-name">${patientName}</div>`;
+        actionBtn = `<span>Booked</span>`;
+    }
+
+    card.innerHTML = `
+        <div class="slot-time">${time}</div>
+        ${detailsHtml}
+        <div class="slot-status">${status.toUpperCase()}</div>
+        <div class="slot-action">${actionBtn}</div>
+    `;
+    return card;
+}
+
 function toggleSlot(date, time, action) {
     fetch('/api/calendar/manage/toggle', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ date, time, action })
+        body: JSON.stringify({ date, time, action, doctor: currentDoctorId })
     })
         .then(res => res.json())
         .then(data => {
             if (data.status === 'success') {
-                loaddocSlots(); // Refresh UI
+                // Update this dashboard directly; the slot stream only serves other dashboards
+                const existing = document.querySelector(`.slot-card[data-time="${time}"]`);
+                const status = action === 'block' ? 'blocked' : 'available';
+                if (existing && document.getElementById('manage-date').value === date) {
+                    existing.replaceWith(renderSlotCard(date, time, { status: status, details: '' }));
+                } else {
+                    loaddocSlots();
+                }
             } else {
                 alert("Failed: " + data.message);
             }
@@ -306,7 +442,7 @@ function fetchSlots() {
     select.innerHTML = '<option>Loading...</option>';
     select.disabled = true;
 
-    fetch(`/api/calendar/slots?date=${date}`)
+    fetch(withDoctor(`/api/calendar/slots?date=${date}`))
         .then(res => res.json())
         .then(slots => {
             select.innerHTML = '';
@@ -342,7 +478,8 @@ function bookSlot() {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
             start_time: start_time,
-            summary: "Patient Consultation (Booked via Dashboard)"
+            summary: "Patient Consultation (Booked via Dashboard)",
+            doctor: currentDoctorId
         })
     })
         .then(res => res.json())
@@ -352,13 +489,87 @@ function bookSlot() {
                 fetchEvents();
                 // Clear selection
                 document.getElementById('booking-slot').value = '';
-                fetchSlots(); // Refresh slots to remove the booked one (if we had real-time refresh)
+                fetchSlots(); // Refresh slots to remove the booked one
             } else {
                 alert('Booking failed: ' + data.message);
             }
         });
 }
 
+// --- Real-time Slot Updates ---
+let slotEventSource = null;
+
+function subscribeSlotUpdates() {
+    if (!window.EventSource) return;
+    if (slotEventSource) slotEventSource.close();
+
+    // The server only streams the selected doctor's slots.
+    // EventSource reconnects on its own if the connection drops
+    const source = new EventSource(withDoctor('/api/calendar/stream'));
+    let opened = false;
+    slotEventSource = source;
+
+    source.addEventListener('slots', e => applySlotDelta(JSON.parse(e.data)));
+    source.onopen = () => {
+        // Deltas published while disconnected are lost, so resync on every reconnect
+        if (opened) resyncSlots();
+        opened = true;
+    };
+    source.onerror = () => {
+        // A refused stream (e.g. the server's stream limit) is not retried by the browser
+        if (source.readyState === EventSource.CLOSED && slotEventSource === source) {
+            setTimeout(() => {
+                if (slotEventSource === source) subscribeSlotUpdates();
+            }, 30000);
+        }
+    };
+}
+
+function resyncSlots() {
+    const manageDate = document.getElementById('manage-date');
+    if (currentTab === 'calendar' && manageDate && manageDate.value) loaddocSlots();
+
+    const bookingDate = document.getElementById('booking-date');
+    if (bookingDate && bookingDate.value) fetchSlots();
+}
+
+function applySlotDelta(delta) {
+    // delta: { date, doctor, slots: { time: { status, details } } }
+    if (currentDoctorId && delta.doctor && delta.doctor !== currentDoctorId) return;
+
+    const manageDate = document.getElementById('manage-date');
+    if (manageDate && manageDate.value === delta.date) {
+        Object.keys(delta.slots).forEach(time => {
+            const existing = document.querySelector(`.slot-card[data-time="${time}"]`);
+            if (existing) {
+                existing.replaceWith(renderSlotCard(delta.date, time, delta.slots[time]));
+            }
+        });
+    }
+
+    const bookingDate = document.getElementById('booking-date');
+    const select = document.getElementById('booking-slot');
+    if (bookingDate && select && bookingDate.value === delta.date && !select.disabled) {
+        Object.keys(delta.slots).forEach(time => {
+            const option = select.querySelector(`option[value="${time}"]`);
+            const available = delta.slots[time].status === 'available';
+            if (!available && option) {
+                option.remove();
+            } else if (available && !option) {
+                const opt = document.createElement('option');
+                opt.value = time;
+                opt.innerText = time;
+                // Keep options in time order
+                const next = Array.from(select.options).find(o => o.value > time);
+                select.insertBefore(opt, next || null);
+            }
+        });
+        // Drop the "No slots available" placeholder once a slot opens up
+        const placeholder = select.querySelector('option[value=""]');
+        if (placeholder && select.options.length > 1) placeholder.remove();
+    }
+}
+
 // Close modal when clicking outside
 window.onclick = function (event) {
     if (event.target == document.getElementById('patient-modal')) {
@@ -0,0 +1,67 @@
+import time
+from semantic_cache import SemanticCache
+
+def make_cache(*prompts):
+    cache = SemanticCache()
+    for prompt in prompts:
+        cache.put(prompt, f"answer for {prompt}")
+    return cache
+
+def test_reordered_paraphrase_hits():
+    cache = make_cache("stage 3 CKD with hypertension")
+    hit = cache.get("hypertension, CKD stage III")
+    assert hit is not None
+    assert hit['response'] == "answer for stage 3 CKD with hypertension"
+    assert hit['similarity'] >= cache.threshold
+
+def test_synonyms_hit():
+    cache = make_cache("Chronic kidney disease with HTN")
+    assert cache.get("hypertensive CKD") is not None
+
+def test_dropped_comorbidity_misses():
+    cache = make_cache("CKD with hypertension and diabetes")
+    assert cache.get("CKD with hypertension") is None
+
+def test_added_comorbidity_misses():
+    cache = make_cache("CKD with hypertension")
+    assert cache.get("CKD with hypertension and diabetes") is None
+
+def test_common_terms_still_required():
+    # Terms shared by many cached prompts get little IDF weight but must still match
+    prompts = [f"CKD with {c} and diabetes" for c in ("gout", "anemia", "edema", "acidosis", "neuropathy")]
+    cache = make_cache("CKD with hypertension and diabetes", *prompts)
+    assert cache.get("CKD with hypertension") is None
+    assert cache.get("hypertension and diabetes") is None
+
+    cache = make_cache("CKD with hypertension", "CKD with anemia")
+    assert cache.get("hypertension") is None
+    assert cache.get("anemia") is None
+
+def test_different_stage_misses():
+    cache = make_cache("stage 3 CKD with hypertension")
+    assert cache.get("stage 4 CKD with hypertension") is None
+    assert cache.get("stage IV CKD with hypertension") is None
+
+def test_different_term_misses():
+    cache = make_cache("stage 3 CKD with hypotension", "patient on losartan")
+    assert cache.get("stage 3 CKD with vasculitis") is None
+    assert cache.get("nephrotic") is None
+
+def test_expired_entries_miss():
+    cache = SemanticCache(ttl_seconds=0.01)
+    cache.put("CKD with anemia", "answer")
+    time.sleep(0.02)
+    assert cache.get("CKD with anemia") is None
+
+def test_lru_eviction_at_size_cap():
+    cache = SemanticCache(max_entries=2)
+    cache.put("CKD with anemia", "a")
+    time.sleep(0.01)
+    cache.put("CKD with gout", "b")
+    time.sleep(0.01)
+    cache.get("CKD with anemia")  # gout is now least recently used
+    time.sleep(0.01)
+    cache.put("CKD with edema", "c")
+    assert cache.get("CKD with gout") is None
+    assert cache.get("CKD with anemia") is not None
+    assert cache.get("CKD with edema") is not None